@@ -610,8 +610,9 @@ def cart2pol3d(x, y, z):
         Outputs:
             * r_pol, theta_pol, phi_pol are polar coordinates.
     '''
-    r_pol = np.sqrt(x**2 + y**2 + z**2)
-    theta_pol = np.arccos(z/r_pol)
+    r_xy = np.hypot(x, y)
+    r_pol = np.hypot(r_xy, z)
+    theta_pol = np.arctan2(r_xy, z)
     phi_pol = np.arctan2(y, x)
     return r_pol, theta_pol, phi_pol
 
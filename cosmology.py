@@ -3,7 +3,6 @@ This module stores the cosmological model in use; any functions that depend on c
 are defined here, referring to an atropy cosmology object that is global, and can be set
 to something other than the default (Outer Rim) by passing through inps.py
 """
-import pdb
 import numpy as np
 import astropy.units as u
 import astropy.constants as const
@@ -27,6 +26,7 @@ cosmo = OuterRim_params
 def update_cosmology(new_cosmo):
     global cosmo
     cosmo = new_cosmo
+    _tabulate_distances()
 
 def rho_crit_z0():
     # critical density in solMass/Mpc^3 at z=0
@@ -48,18 +48,54 @@ def update_sim(new_sim):
     global sim
     for key in new_sim:
         sim[key] = new_sim[key]
+    if('z_init' in new_sim):
+        _tabulate_distances()
+
+
+# ------------- tabulated distances -------------
+
+# astropy distance calls are slow, so the comoving and angular diameter distances are tabulated 
+# once per cosmology/sim on a grid that is logarithmic in (1+z), out to the initial redshift of the simulation. The
+# functions below then interpolate from this table. Rather than the distances themselves, which are 
+# linear in z at low redshift, the ratios Dc/z and Da*(1+z)/z are interpolated in ln(1+z); these are smooth 
+# everywhere (both tend to the Hubble distance as z -> 0), and so are recovered to ~2e-7 at all redshifts
+_z_tab = None
+_s_tab = None
+_dc_ratio_tab = None
+_dm_ratio_tab = None
+def _tabulate_distances(ntab=4096):
+    global _z_tab, _s_tab, _dc_ratio_tab, _dm_ratio_tab
+    _z_tab = np.logspace(0, np.log10(1+sim['z_init']), ntab) - 1
+    _z_tab[0], _z_tab[-1] = 0, sim['z_init']
+    _s_tab = np.log1p(_z_tab)
+    _dc_ratio_tab = np.empty(ntab)
+    _dm_ratio_tab = np.empty(ntab)
+    _dc_ratio_tab[0] = _dm_ratio_tab[0] = cosmo.hubble_distance.value
+    _dc_ratio_tab[1:] = cosmo.comoving_distance(_z_tab[1:]).value / _z_tab[1:]
+    _dm_ratio_tab[1:] = cosmo.angular_diameter_distance(_z_tab[1:]).value * (1+_z_tab[1:]) / _z_tab[1:]
+_tabulate_distances()
+
+def _check_z(z):
+    # the tables only cover 0 <= z <= z_init; raise rather than let np.interp clamp to the end points
+    z = np.asarray(z)
+    if(np.any(z < 0) or np.any(z > _z_tab[-1])):
+        raise ValueError('redshifts must lie within [0, z_init={}]'.format(_z_tab[-1]))
+    return z
 
 
 # ----------- functions of cosmology ------------
 
 # Nan previously had a +1e-8 in Dc2() and Da2(), so check that if a zero error occurs in the cfuncs
+# All of these accept scalar or array redshifts
 def Dc(z):
-    return cosmo.comoving_distance(z).value
+    z = _check_z(z)
+    return z * np.interp(np.log1p(z), _s_tab, _dc_ratio_tab)
 def Dc2(z1,z2):
-    return Dc(z2) - Dc(z2)
+    return Dc(z2) - Dc(z1)
 
 def Da(z):
-    return cosmo.angular_diameter_distance(z).value
+    z = _check_z(z)
+    return z/(1+z) * np.interp(np.log1p(z), _s_tab, _dm_ratio_tab)
 def Da2(z1,z2):
     return (Da(z2) - Da(z1))
 
@@ -102,15 +138,17 @@ def schwarzschild_deflection(M, fov_size, nnn):
     '''
     '''
 
-    # get proper distances on lens plane of grid points
+    # get proper distances on lens plane of grid points; the grid is built by broadcasting a row 
+    # and column vector, rather than materializing a meshgrid
     gridpt = np.linspace(-fov_size/2, fov_size/2, nnn)
-    xi1, xi2 = np.meshgrid(gridpt,gridpt)
-    xi = np.linalg.norm([xi1, xi2], axis=0)
-    phi = np.arccos(xi1/xi)
+    xi1 = gridpt[np.newaxis, :]
+    xi2 = gridpt[:, np.newaxis]
 
     # deflection components (see Meneghetti's lensing review, Eq. 1.37-1.41)
-    alpha1 = 4*G*M/vc**2 * xi1/xi**2
-    alpha2 = 4*G*M/vc**2 * xi2/xi**2    
+    k = xi1*xi1 + xi2*xi2
+    np.divide(4*G*M/vc**2, k, out=k)
+    alpha1 = k * xi1
+    alpha2 = np.multiply(k, xi2, out=k)
     
     return alpha1, alpha2
 
@@ -130,19 +168,15 @@ def Nz_Chang2014(z_bin_edges, case='fiducial', sys='blending'):
     B = p[case]['B']
     neff = p[case]['neff_{}'.format(sys)]
 
-    # integrate over P(z) to z=4
+    # cumulative trapezoidal integral of P(z) to z=4
     z_samp_all = np.linspace(0, 4, 10000)
     Pz_all = z_samp_all **a * np.exp(-(z_samp_all/z0)**B)
-    tot_all = np.trapz(Pz_all, z_samp_all, np.diff(z_samp_all)[0])
+    cdf = np.concatenate(([0], np.cumsum(0.5*(Pz_all[1:]+Pz_all[:-1]) * np.diff(z_samp_all))))
+    tot_all = cdf[-1]
     
-    # integrate over the specified bounds
-    neff_bins = np.zeros(len(z_bin_edges)-1)
-    for i in range(len(z_bin_edges)-1):
-        z_samp = np.linspace(z_bin_edges[i], z_bin_edges[i+1], 10000)
-        Pz = z_samp**a * np.exp(-(z_samp/z0)**B)
-        tot = np.trapz(Pz, z_samp, np.diff(z_samp)[0])
-
-        # normalize P(z) and multiply by total neff
-        neff_bins[i] = tot/tot_all * neff
+    # integrate over the specified bounds by differencing the cumulative integral at the bin edges,
+    # then normalize P(z) and multiply by total neff
+    cdf_at_edges = np.interp(z_bin_edges, z_samp_all, cdf)
+    neff_bins = np.diff(cdf_at_edges)/tot_all * neff
 
     return neff_bins
@@ -2,6 +2,7 @@ import os
 import pdb
 import sys
 import glob
+import json
 import h5py
 import subprocess
 import halo_inputs
@@ -110,6 +111,15 @@ class grid_map_generator():
         columns = ['redshift', 'x', 'y', 'z', 'theta', 'phi']
         arrs = [self.zp_los, self.xxp_los, self.yyp_los, self.zzp_los, self.tp_los, self.pp_los]
         
+        # single-plane inputs may have been written at reduced precision, in which case the data 
+        # type of each column is given in a sidecar file; either way, the particle data is held as float32
+        dtypes = {}
+        dtype_file = '{}/particles.dtype.json'.format(self.pdir)
+        if(not self.multiplane and os.path.isfile(dtype_file)):
+            with open(dtype_file) as f:
+                sidecar = json.load(f)
+            dtypes = dict(zip(sidecar['names'], sidecar['dtypes']))
+        
         # particle data from all lens planes will be read into single flattened arrays for multi-plane case
         for i in range(len(arrs)):
             if(self.multiplane):
@@ -117,7 +127,8 @@ class grid_map_generator():
                     arrs[i] = np.hstack([arrs[i], np.fromfile('{0}/{2}Cutout{1}/{2}.{1}.bin'.format(self.pdir, 
                                                                snapid, self.pfx, columns[i]), dtype = "f")])
             else: 
-                arrs[i] = np.fromfile('{0}/{1}.bin'.format(self.pdir, columns[i]), dtype = "f")
+                arrs[i] = np.fromfile('{0}/{1}.bin'.format(self.pdir, columns[i]), 
+                                      dtype = dtypes.get(columns[i], "f")).astype("f", copy=False)
         self.zp_los, self.xxp_los, self.yyp_los, self.zzp_los, self.tp_los, self.pp_los = arrs
 
         if(inv_h == True):
@@ -367,7 +378,7 @@ class grid_map_generator():
             # x2 coaltitude projected distance in comoving Mpc
             # x3 in comoving Mpc along the LOS
 
-            rp = np.linalg.norm(np.vstack([xxp, yyp, zzp]), axis=0)
+            rp = np.hypot(np.hypot(xxp, yyp), zzp)
             rp_center = (np.max(rp)+np.min(rp))*0.5
             plane_width = 0.95 * (np.tan(bsz_arc/cm.apr/2) * rp_center * 2)
             x3in = rp - rp_center
@@ -387,9 +398,13 @@ class grid_map_generator():
             elif(self.density_estimator == 'dtfe'):
                 self.print('doing DTFE density estimation')
                 
-                # x, y, z in column major
-                dtfe_input_array = np.ravel(np.vstack([x1in, x2in, x3in]))
-                dtfe_input_array.astype('f').tofile(dtfe_file)
+                # x, y, z in column major, staged directly as float32 (rather than stacking in the input 
+                # precision and then casting a copy)
+                npart = len(x1in)
+                dtfe_input_array = np.empty(3*npart, dtype='f')
+                for i, xin in enumerate([x1in, x2in, x3in]):
+                    dtfe_input_array[i*npart:(i+1)*npart] = xin
+                dtfe_input_array.tofile(dtfe_file)
                 
                 if(image_out == True): image_out = 1
                 else: image_out = 0
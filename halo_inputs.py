@@ -1,6 +1,4 @@
 import os
-import pdb
-import glob
 import shutil
 import numpy as np
 from astropy.cosmology import WMAP7
@@ -19,7 +17,13 @@ class halo_inputs():
 
         self.input_prtcls_dir = halo_cutout_parent_dir
         self.halo_prop_file = '{}/properties.csv'.format(self.input_prtcls_dir)
-        self.halo_props = np.genfromtxt(self.halo_prop_file, delimiter=',', names=True)
+        
+        # halo properties are stored as a dict of column name to value
+        with open(self.halo_prop_file) as f:
+            header = f.readline()
+        names = [col.strip().strip(' #') for col in header.split(',')]
+        values = np.loadtxt(self.halo_prop_file, delimiter=',', skiprows=1, ndmin=1)
+        self.halo_props = dict(zip(names, values))
         if(halo_id is None):
             self.halo_id = halo_cutout_parent_dir.split('halo_')[-1]
         else: self.halo_id = halo_id 
@@ -34,7 +38,7 @@ class halo_inputs():
         # automatically overwrite the default value in the global cosmo object
         if(sim is not None):
             cm.update_sim(sim)
-        if('mpp' in self.halo_props.dtype.names):
+        if('mpp' in self.halo_props):
             cm.update_sim({'mpp':self.halo_props['mpp']})
         self.sim = cm.sim
         
@@ -57,10 +61,11 @@ class halo_inputs():
         #self.mpp = self.mpp * 100 # uncomment for downsampled inputs
         self.npad = 5
     
-        # gen grid points in arcsec
+        # gen grid points in arcsec; xi1, xi2 are read-only broadcast views of the 1d grid (equivalent 
+        # to np.meshgrid(x1, x2), without allocating two nnn x nnn arrays per halo)
         x1 = np.linspace(0,self.bsz_arc-self.dsx_arc,self.nnn) - self.bsz_arc/2.0 + self.dsx_arc/2.0
-        x2 = np.linspace(0,self.bsz_arc-self.dsx_arc,self.nnn) - self.bsz_arc/2.0 + self.dsx_arc/2.0
-        self.xi1, self.xi2 = np.meshgrid(x1,x2)
+        self.xi1 = np.broadcast_to(x1[np.newaxis, :], (self.nnn, self.nnn))
+        self.xi2 = np.broadcast_to(x1[:, np.newaxis], (self.nnn, self.nnn))
 
         #--------------------------------- outputs --------------------------------------------
 
@@ -76,7 +81,7 @@ class halo_inputs():
         for path in [self.outputs_path, self.dtfe_path, self.xj_path]:
             if not os.path.exists(path):
                     os.makedirs(path)
-        if( len(glob.glob('{}/properties.csv'.format(self.outputs_path))) == 0):
+        if not os.path.isfile('{}/properties.csv'.format(self.outputs_path)):
             shutil.copyfile(self.halo_prop_file, '{}/properties.csv'.format(self.outputs_path))
 
 
@@ -103,8 +108,8 @@ class multi_plane_inputs(halo_inputs):
         
         self.mean_lens_width = mean_lens_width
         self.halo_shell = int(self.halo_props['halo_lc_shell'])
-        self.snapid_list = np.array([int(s.split('Cutout')[-1]) for s in 
-                                     glob.glob('{}/*Cutout*'.format(self.input_prtcls_dir))])
+        self.snapid_list = np.fromiter((int(e.name.split('Cutout')[-1]) for e in 
+                                        os.scandir(self.input_prtcls_dir) if 'Cutout' in e.name), dtype=np.int64)
         self.snapid_redshift = 1 / np.linspace(1/(self.sim['z_init']+1), 1, 
                                                self.sim['sim_steps'])[self.snapid_list] - 1
 
@@ -124,13 +129,10 @@ class multi_plane_inputs(halo_inputs):
         self.lens_plane_edges = np.linspace(0, self.max_redshift, self.num_lens_planes+1)
         
         # remove any lens plane edge that is within {safe_zone}Mpc of the halo redshift
-        bad_edges = []
-        for i in range(len(self.lens_plane_edges)):
-            if( abs(comv(self.halo_redshift).value-comv(self.lens_plane_edges[i]).value) <= safe_zone):
-                bad_edges.append(i)
-        for i in bad_edges:
-            self.lens_plane_edges = np.delete(self.lens_plane_edges, i)
-            self.num_lens_planes -= 1
+        edge_dc = comv(self.lens_plane_edges).value
+        edge_mask = np.abs(comv(self.halo_redshift).value - edge_dc) > safe_zone
+        self.lens_plane_edges = self.lens_plane_edges[edge_mask]
+        self.num_lens_planes = np.sum(edge_mask) - 1
         
         # trim off lens planes below min_depth (for the use case that there is an empty LOS 
         # except for at some specific location, as in the simple NFW test provided)
@@ -146,8 +146,8 @@ class lensing_mock_generator():
 
         elif(type(nsrcs) in [int, float] and n_places=='grid'):
             nsrcs = int(nsrcs)
-            grid = np.meshgrid(np.linspace(-self.inp.bsz_arc/2, self.inp.bsz_arc, np.sqrt(nsrcs)), 
-                               np.linspace(-self.inp.bsz_arc/2, self.inp.bsz_arc, np.sqrt(nsrcs)))
+            grid = np.meshgrid(np.linspace(-self.inp.bsz_arc/2, self.inp.bsz_arc/2, int(np.sqrt(nsrcs))), 
+                               np.linspace(-self.inp.bsz_arc/2, self.inp.bsz_arc/2, int(np.sqrt(nsrcs))))
             ys1_arrays = np.array([np.ravel(grid[0]) for i in range(len(zs))])
             ys2_arrays = np.array([np.ravel(grid[1]) for i in range(len(zs))])
         
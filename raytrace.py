@@ -236,8 +236,8 @@ class ray_tracer():
             return xx1*0.0,xx2*0.0
 
         if n == 1 :
-            xx1.astype('double').tofile(self.inp.xj_path+str(n-1)+"_xj1.bin")
-            xx2.astype('double').tofile(self.inp.xj_path+str(n-1)+"_xj2.bin")
+            xx1.astype('double', copy=False).tofile(self.inp.xj_path+str(n-1)+"_xj1.bin")
+            xx2.astype('double', copy=False).tofile(self.inp.xj_path+str(n-1)+"_xj2.bin")
             return xx1,xx2
 
         if n == 2:
@@ -266,8 +266,8 @@ class ray_tracer():
             x21 = x11*bij-(bij-1)*x01-ahm11*cm.Da2(z1,z2)/cm.Da(z2)
             x22 = x12*bij-(bij-1)*x02-ahm12*cm.Da2(z1,z2)/cm.Da(z2)
 
-            x21.astype('double').tofile(self.inp.xj_path+str(n-1)+"_xj1.bin")
-            x22.astype('double').tofile(self.inp.xj_path+str(n-1)+"_xj2.bin")
+            x21.astype('double', copy=False).tofile(self.inp.xj_path+str(n-1)+"_xj1.bin")
+            x22.astype('double', copy=False).tofile(self.inp.xj_path+str(n-1)+"_xj2.bin")
 
             return x21,x22
 
@@ -300,7 +300,7 @@ class ray_tracer():
             xj1 = xjm11*bij-(bij-1)*xjm21-ahjm11*cm.Da2(zim1,zi)/cm.Da(zi)
             xj2 = xjm12*bij-(bij-1)*xjm22-ahjm12*cm.Da2(zim1,zi)/cm.Da(zi)
 
-            xj1.astype('double').tofile(self.inp.xj_path+str(n-1)+"_xj1.bin")
-            xj2.astype('double').tofile(self.inp.xj_path+str(n-1)+"_xj2.bin")
+            xj1.astype('double', copy=False).tofile(self.inp.xj_path+str(n-1)+"_xj1.bin")
+            xj2.astype('double', copy=False).tofile(self.inp.xj_path+str(n-1)+"_xj2.bin")
 
             return xj1,xj2
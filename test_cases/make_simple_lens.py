@@ -1,30 +1,474 @@
-import os
 import sys
-import pdb
-import scipy
+import math
+import functools
+import json
 import pathlib
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from scipy import stats
-import matplotlib as mpl
-from matplotlib import rc
-from astropy import units as u
-import matplotlib.pyplot as plt
-from mpl_toolkits.mplot3d import Axes3D
 from colossus.cosmology import cosmology as colcos
-from astropy.cosmology import WMAP7, z_at_value
+from astropy.cosmology import WMAP7
 from halotools.empirical_models import NFWProfile
 from colossus.halo.concentration import concentration as mass_conc
-rc('text', usetex=True)
+try:
+    import cupy
+except ImportError:
+    cupy = None
 
-sys.path.append('{}/..'.format(pathlib.Path(__file__).parent.absolute()))
+# the ray tracing modules live in the directory above, which is not a package; add it to the path only 
+# if it isn't already there (resolving symlinks), so that cosmology is only ever imported under one name
+_pkg_dir = str(pathlib.Path(__file__).resolve().parent.parent)
+if(_pkg_dir not in (str(pathlib.Path(pth).resolve()) for pth in sys.path)):
+    sys.path.append(_pkg_dir)
 import cosmology as cm
 
 
 # =========================================================================================
 
 
+def _array_module(arr):
+    """
+    Returns the array module, numpy or cupy, that owns the array arr
+    """
+    if(cupy is None):
+        return np
+    return cupy.get_array_module(arr)
+
+
+# arcseconds per radian, folded into a single constant (648000 = 180*3600) so that the angular 
+# outputs are scaled with one multiply per element
+_RAD2ARCSEC = 648000.0/np.pi
+
+
+def _sph_to_cart(r, cos_theta, sin_theta, phi):
+    """
+    Transforms spherical coordinates to cartesian. The coaltitude is given by its cosine and sine, so 
+    that only the azimuthal trigonometric functions are evaluated, once per particle. The outputs have 
+    the data type of the inputs (float32 in this module, matching its binary outputs). The inputs may 
+    also be CuPy arrays, in which case the transformation is done on the device.
+
+    Parameters
+    ----------
+    r : float array
+        Radial coordinates
+    cos_theta, sin_theta : float arrays
+        Cosine and sine of the coaltitude coordinates
+    phi : float array
+        Azimuthal coordinates, in radians
+
+    Returns
+    -------
+    x, y, z : float arrays
+        The cartesian coordinates
+    """
+    xp = _array_module(r)
+    r_sin_theta = r * sin_theta
+    x = r_sin_theta * xp.cos(phi)
+    y = xp.multiply(r_sin_theta, xp.sin(phi), out=r_sin_theta)
+    z = r * cos_theta
+    return x, y, z
+
+
+def _cart_to_sph(x, y, z, out):
+    """
+    Transforms cartesian coordinates to spherical, without forming any stacked (3,N) temporaries. 
+    The angles are computed with arctan2, which is correct in all quadrants and well-behaved near 
+    the coordinate axes.
+
+    Parameters
+    ----------
+    x, y, z : float arrays
+        The cartesian coordinates
+    out : tuple of three arrays
+        Arrays into which to write r, theta, phi
+
+    Returns
+    -------
+    r, theta, phi : float arrays
+        The radial, coaltitude, and azimuthal coordinates, with angles in radians
+    """
+    r, theta, phi = out
+
+    r_xy = np.hypot(x, y)
+    np.hypot(r_xy, z, out=r)
+    np.arctan2(r_xy, z, out=theta)
+    np.arctan2(y, x, out=phi)
+    return r, theta, phi
+
+
+# the maximum extent of a halo, as a fraction of its distance, for which _local_to_sky() may use the 
+# small-angle approximation; the leading neglected term is then < 1e-9/3 rad, far below float32 precision 
+# of the output angles
+_SMALL_ANGLE_MAX = 1e-3
+def _local_to_sky(x_local, y_local, z_local, x0, out, small_angle=False):
+    """
+    Places particles with cartesian positions relative to the halo center at a distance x0 along 
+    the x-axis, and computes their spherical sky coordinates with respect to the origin (with 
+    _cart_to_sph()), with angles in arcseconds. 
+    
+    If small_angle is True, the angles are instead computed to first order in the angular offsets 
+    from the x-axis, as theta = pi/2 - z/r_xy, and phi = y/x, avoiding both inverse trigonometric 
+    functions. This is only valid if all particles lie within a tiny angle of the x-axis; see 
+    _SMALL_ANGLE_MAX.
+
+    Parameters
+    ----------
+    x_local, y_local, z_local : float arrays
+        The cartesian positions relative to the halo center
+    x0 : float
+        The distance to the halo center along the x-axis
+    out : tuple of six arrays
+        Arrays into which to write x, y, z, r, theta, phi
+    small_angle : bool, optional
+        Whether or not to use the small-angle approximation for the angles. Defaults to False
+
+    Returns
+    -------
+    x, y, z, r, theta, phi : float arrays
+        The cartesian and spherical coordinates wrt the origin, with angles in arcseconds
+    """
+    x, y, z, r, theta, phi = out
+    np.add(x_local, x0, out=x)
+    np.copyto(y, y_local)
+    np.copyto(z, z_local)
+    if(small_angle):
+        r_xy = np.hypot(x, y)
+        np.hypot(r_xy, z, out=r)
+        np.divide(z, r_xy, out=theta)
+        np.subtract(np.pi/2, theta, out=theta)
+        np.divide(y, x, out=phi)
+    else:
+        _cart_to_sph(x, y, z, out=(r, theta, phi))
+    np.multiply(theta, _RAD2ARCSEC, out=theta)
+    np.multiply(phi, _RAD2ARCSEC, out=phi)
+    return x, y, z, r, theta, phi
+
+
+def _nfw_m_enc(m200c, c, rfrac):
+    """
+    Returns the mass of an NFW halo enclosed within rfrac * r200c. This is the analytic integration 
+    of the NFW profile in terms of m_200c, assuming c=c_200c. Evaluated with scalar math, rather than
+    numpy ufuncs, since all inputs are scalars.
+
+    Parameters
+    ----------
+    m200c : float
+        The mass of the halo within r200c
+    c : float
+        The concentration of the halo, r200c/r_s
+    rfrac : float
+        Multiplier of r200c giving the radius within which to compute the enclosed mass
+    """
+    x = rfrac * c
+    n = math.log1p(x) - x/(1+x)
+    d = math.log1p(c) - c/(1+c)
+    return m200c * n/d
+
+
+# the independent random streams of each halo, by their index among the children of 
+# np.random.SeedSequence(seed) (see NFW._stream_seed())
+_ANGULAR_STREAM, _RADIAL_STREAM, _CONC_STREAM = range(3)
+
+
+# tabulated NFW cumulative mass profiles, for the most recently used concentrations (bounded, since 
+# concentrations drawn from the c-M relation are rarely repeated exactly)
+@functools.lru_cache(maxsize=32)
+def _nfw_icdf_table(conc, ntab=4096):
+    """
+    Returns a tabulation of the cumulative mass profile of an NFW halo truncated at conc scale radii, 
+    M(<x)/M(<conc) = [ln(1+x) - x/(1+x)] / [ln(1+conc) - conc/(1+conc)], with x = r/r_s, on a grid 
+    logarithmic in x. The returned arrays are shared between calls, and should not be modified.
+
+    Parameters
+    ----------
+    conc : float
+        The concentration of the truncated profile, i.e. the truncation radius in units of r_s
+    ntab : int, optional
+        The number of grid points, in addition to x=0. Defaults to 4096
+
+    Returns
+    -------
+    cdf : float array
+        The normalized enclosed mass at each grid point, increasing monotonically from 0 to 1
+    x_grid : float array
+        The grid in x = r/r_s
+    """
+    x_grid = np.concatenate([[0], np.logspace(-4, np.log10(conc), ntab)])
+    cdf = (np.log1p(x_grid) - x_grid/(1+x_grid)) / (math.log1p(conc) - conc/(1+conc))
+    return cdf, x_grid
+
+
+# minimum number of particles for which NFW.populate_halo will split the radial position draw 
+# across processes, if requested
+_PARALLEL_MIN_N = 100000
+def _radial_positions_chunk(args):
+    """
+    Draws NFW radial positions by inverse transform sampling of the tabulated cumulative mass 
+    profile; used by NFW._radial_positions(), either directly, or for one chunk in a worker process.
+
+    Parameters
+    ----------
+    args : tuple
+        (N, conc, halo_radius, seed), where seed is anything accepted by np.random.default_rng()
+
+    Returns
+    -------
+    r : float array
+        N radial positions, in the units of halo_radius
+    """
+    N, conc, halo_radius, seed = args
+    cdf, x_grid = _nfw_icdf_table(conc)
+    u = np.random.default_rng(seed).random(N)
+    r = np.interp(u, cdf, x_grid)
+    r *= halo_radius / conc
+    return r
+
+
+class _CosmoKey:
+    """
+    Wraps an AstroPy cosmology, which is unhashable, so that it can be passed to functions memoized 
+    with functools.lru_cache. Keys compare by identity, and each holds a reference to its cosmology, 
+    so that the id of any cosmology present in a cache cannot be reused
+    """
+    __slots__ = ('cosmo',)
+    def __init__(self, cosmo):
+        self.cosmo = cosmo
+    def __hash__(self):
+        return id(self.cosmo)
+    def __eq__(self, other):
+        return isinstance(other, _CosmoKey) and self.cosmo is other.cosmo
+
+
+def _nfw_profile(cosmo, z, mdef='200c'):
+    """
+    Returns a HaloTools NFWProfile for the given cosmology, redshift, and mass definition, constructing 
+    it only the first time that combination is requested, and keeping only the most recently used 
+    profiles (see _nfw_profile_of())
+
+    Parameters
+    ----------
+    cosmo : object
+        An AstroPy cosmology object
+    z : float
+        The redshift of the profile
+    mdef : string, optional
+        The HaloTools mass definition. Defaults to '200c'
+    """
+    return _nfw_profile_of(_CosmoKey(cosmo), z, mdef)
+
+
+# HaloTools profiles, for the most recently used combinations of cosmology, redshift, and mass definition 
+# (bounded, since every distinct halo redshift gives a new profile)
+@functools.lru_cache(maxsize=128)
+def _nfw_profile_of(cosmo_key, z, mdef):
+    return NFWProfile(cosmology=cosmo_key.cosmo, redshift=z, mdef=mdef)
+
+
+def _build_z_of_dcom(cosmo, zmax=5.0, n=4096):
+    """
+    Returns a tabulation of the comoving distance-redshift relation of a cosmology, on a grid 
+    linear in redshift, for inverting comoving distances to redshifts with np.interp. The table 
+    is computed only the first time each combination of arguments is requested, and only the most 
+    recently used tables are kept (see _z_of_dcom_table())
+
+    Parameters
+    ----------
+    cosmo : object
+        An AstroPy cosmology object
+    zmax : float, optional
+        The maximum redshift of the table. Defaults to 5
+    n : int, optional
+        The number of grid points. Defaults to 4096
+
+    Returns
+    -------
+    dcom_grid : float array
+        The comoving distance at each grid point, in Mpc, increasing monotonically
+    z_grid : float array
+        The grid in redshift
+    """
+    return _z_of_dcom_table(_CosmoKey(cosmo), float(zmax), n)
+
+
+# tabulated comoving distance-redshift relations, for the most recently used combinations of cosmology, 
+# zmax, and n (bounded, since each table is 2*n floats, and NFW rounds zmax up to a coarse ladder)
+@functools.lru_cache(maxsize=16)
+def _z_of_dcom_table(cosmo_key, zmax, n):
+    z_grid = np.linspace(0, zmax, n)
+    return cosmo_key.cosmo.comoving_distance(z_grid).value, z_grid
+
+
+# Colossus cosmologies set by previous NFW instances, keyed by the AstroPy cosmological parameters
+_colossus_cosmologies = {}
+def _colossus_cosmology(Om0, Ob0, H0):
+    """
+    Sets the global Colossus cosmology matching the parameters of an AstroPy cosmology, as needed for 
+    the Child+2018 concentration model. Colossus setCosmology() is only called the first time a set of 
+    parameters is seen; on later calls the stored object is simply made current again, if it isn't already.
+
+    Parameters
+    ----------
+    Om0, Ob0 : float
+        The matter and baryon density parameters of the AstroPy cosmology
+    H0 : float
+        The Hubble constant of the AstroPy cosmology, in km/s/Mpc
+    
+    Returns
+    -------
+    cosmo_colossus : object
+        The current Colossus cosmology object
+    """
+    key = (Om0, Ob0, H0)
+    cosmo_colossus = _colossus_cosmologies.get(key)
+    if(cosmo_colossus is None):
+        cosmo_colossus = colcos.setCosmology('OuterRim',
+                         {'Om0':Om0, 'Ob0':Ob0, 'H0':H0, 'sigma8':0.8, 'ns':0.963, 'relspecies':False})
+        _colossus_cosmologies[key] = cosmo_colossus
+    elif(colcos.getCurrent() is not cosmo_colossus):
+        colcos.setCurrent(cosmo_colossus)
+    return cosmo_colossus
+
+
+def _child18_concentration(cosmo, m200ch, z):
+    """
+    Returns the scatter-free Child+2018 concentration of a halo, as given by Colossus. Colossus is only 
+    set up and called the first time each combination of cosmology, mass, and redshift is requested, 
+    so that repeated realizations of the same halo (e.g. over seeds or radial extents) skip it entirely.
+    Only the most recently used concentrations are kept (see _child18_concentration_of())
+
+    Parameters
+    ----------
+    cosmo : object
+        An AstroPy cosmology object
+    m200ch : float
+        The halo mass within r200c, in M_sun/h
+    z : float
+        The redshift of the halo
+    """
+    return _child18_concentration_of(cosmo.Om0, cosmo.Ob0, cosmo.H0.value, float(m200ch), z)
+
+
+# Child+2018 concentrations, for the most recently used combinations of AstroPy cosmological parameters, 
+# halo mass, and redshift (bounded, since a halo catalog rarely repeats a mass exactly)
+@functools.lru_cache(maxsize=1024)
+def _child18_concentration_of(Om0, Ob0, H0, m200ch, z):
+    _colossus_cosmology(Om0, Ob0, H0)
+    return mass_conc(m200ch, '200c', z, model='child18')
+
+
+def _write_bin(path, arr, dtype='<f4', chunk=1<<20):
+    """
+    Writes a particle quantity to path as a raw binary of type dtype. If arr is already contiguous 
+    and of that type, its underlying buffer is written with a single call. Otherwise, it is cast 
+    chunk by chunk into one reused staging buffer and written from it, so that neither a full-length 
+    cast copy of arr nor a new temporary per chunk is ever allocated.
+
+    Parameters
+    ----------
+    path : string
+        The output file path
+    arr : float array
+        The quantity to write
+    dtype : string or numpy dtype, optional
+        The data type of the output binary. Defaults to little-endian float32, '<f4'
+    chunk : int, optional
+        The number of elements to cast per write, if arr is not already of type dtype. Defaults to 2^20
+    """
+    dtype = np.dtype(dtype)
+    with open(path, 'wb') as f:
+        if(arr.dtype == dtype and arr.flags['C_CONTIGUOUS']):
+            f.write(arr.view(np.uint8))
+        else:
+            buf = np.empty(min(chunk, len(arr)), dtype=dtype)
+            for i in range(0, len(arr), chunk):
+                n = min(chunk, len(arr) - i)
+                np.copyto(buf[:n], arr[i:i+n], casting='same_kind')
+                f.write(buf[:n].view(np.uint8))
+
+
+# the particle quantities expected by the ray tracing modules, in the order they are staged for output,
+# and the output data types of each at each NFW precision
+_PARTICLE_BIN_NAMES = ('x', 'y', 'z', 'theta', 'phi', 'redshift')
+_PRECISION_DTYPES = {'fp32':('<f4', '<f4', '<f4', '<f4', '<f4', '<f4'), 
+                     'fp16':('<f4', '<f4', '<f4', '<f4', '<f2', '<f2')}
+# minimum number of particles for which _write_particle_bins() writes the binaries from a thread pool
+_THREADED_WRITE_MIN_N = 1<<20
+def _write_particle_bins(output_dir, arrays, names=_PARTICLE_BIN_NAMES, dtypes=_PRECISION_DTYPES['fp32']):
+    """
+    Writes each particle quantity to the binary file {output_dir}/{name}.bin, and records the 
+    binary data type of each in the sidecar file {output_dir}/particles.dtype.json, so that readers 
+    know the precision of the outputs. Every quantity is checked against the range of its data type 
+    before any file is opened, and the sidecar is written before the binaries, so that a binary of 
+    reduced precision is never left on disk without it. The binaries are independent, so for at least 
+    _THREADED_WRITE_MIN_N particles they are written concurrently from a thread pool (the GIL is released 
+    during the writes and casts), which lets the file system pipeline them; below that, starting the 
+    pool costs more than it saves, and they are written in sequence
+
+    Parameters
+    ----------
+    output_dir : string
+        The desired output location for the binary files
+    arrays : iterable of float arrays
+        The particle quantities, e.g. the rows of a (6,N) array, in the order of names
+    names : iterable of strings, optional
+        The name of each quantity. Defaults to x, y, z, theta, phi, redshift
+    dtypes : iterable of strings or numpy dtypes, optional
+        The data type of each output binary, in the order of names; either little-endian float32, 
+        '<f4', or float16, '<f2'. Defaults to float32 for all quantities
+
+    Raises
+    ------
+    ValueError
+        If any quantity holds values beyond the range of its data type (e.g. angles in arcseconds 
+        larger than float16 can represent); in that case, no file is written
+    """
+    names = list(names)
+    arrays = list(arrays)
+    dtypes = [np.dtype(dt) for dt in dtypes]
+    for name, arr, dt in zip(names, arrays, dtypes):
+        if(dt not in (np.dtype('<f4'), np.dtype('<f2'))):
+            raise ValueError('dtype must be one of \'<f4\' or \'<f2\', got {}'.format(dt.str))
+        if(dt.itemsize < arr.dtype.itemsize and len(arr) > 0 and 
+           max(arr.max(), -arr.min()) > np.finfo(dt).max):
+            raise ValueError('{} holds values outside of the range of {}'.format(name, dt.str))
+    
+    with open('{}/particles.dtype.json'.format(output_dir), 'w') as f:
+        json.dump({'names':names, 'dtypes':[dt.str for dt in dtypes]}, f)
+    paths = ['{}/{}.bin'.format(output_dir, name) for name in names]
+    if(max(len(arr) for arr in arrays) < _THREADED_WRITE_MIN_N):
+        for path, arr, dt in zip(paths, arrays, dtypes):
+            _write_bin(path, arr, dtype=dt)
+    else:
+        with ThreadPoolExecutor(max_workers=len(paths)) as ex:
+            list(ex.map(_write_bin, paths, arrays, dtypes))
+
+
+def _write_props(output_dir, props):
+    """
+    Writes a halo property file, properties.csv, of the form read by halo_inputs.
+
+    Parameters
+    ----------
+    output_dir : string
+        The desired output location for the property file
+    props : dict
+        The halo properties, as column name and value pairs, in the desired column order
+    """
+    names = list(props.keys())
+    values = np.array(list(props.values()), dtype='<f8')
+    
+    # a single row doesn't need np.savetxt; write the same bytes it would directly
+    with open('{}/properties.csv'.format(output_dir), 'w') as f:
+        f.write('# {}\n'.format(', '.join(names)))
+        f.write('{}\n'.format(','.join(['{:.6f}'.format(v) for v in values])))
+
+
+# =========================================================================================
+
+
 class NFW:
-    def __init__(self, z, m200c=None, r200c=None, c=None, cM_err=False, cosmo=cm.OuterRim_params, seed=None):
+    def __init__(self, z, m200c=None, r200c=None, c=None, cM_err=False, cosmo=cm.OuterRim_params, seed=None, 
+                 precision='fp32', backend='cpu'):
         """
         Class for generating NFW test-case input files for the ray tracing modules supplied in
         the directory above. This class is constructed with a halo mass, redshift, and 
@@ -53,15 +497,24 @@ class NFW:
             csv file will be zero.
         cosmo : object, optional
             An AstroPy cosmology object. Defaults to OuterRim parameters.
-        seed : float, optional
-            Random seed to pass to HaloTools for generation of radial particle positions, and
-            use for drawing concentrations and angular positions of particles. Defaults to None
+        seed : int, optional
+            Random seed to use for generation of radial particle positions, and for drawing 
+            concentrations and angular positions of particles. Each of these is drawn from its own 
+            independent stream, spawned from np.random.SeedSequence(seed). Defaults to None
             (giving stochastic output)
+        precision : string, optional
+            The precision of the azimuthal angle and redshift outputs; either 'fp32', or 'fp16', which 
+            halves their size on disk. The positions, and the coaltitude (which lies near 90 degrees, 
+            beyond the range of float16 in arcseconds), are always output in float32. Defaults to 'fp32'
+        backend : string, optional
+            Where to generate the particle realization; either 'cpu', or 'cupy', in which case the 
+            radial and angular sampling and the coordinate transformation in populate_halo() run on 
+            the GPU, and the results are copied to the host once, at the end. Defaults to 'cpu'
         
         Methods
         -------
         populate_halo(r)
-            Uses HaloTools to generate a MonteCarlo realization of discrete tracers of the density
+            Generates a MonteCarlo realization of discrete tracers of the density
             profile (particles)
         output_particles():
             Writes out the particle positions generated by populate_halo() to a form that is prepped 
@@ -74,38 +527,63 @@ class NFW:
         self.redshift = z
         self.cosmo = cosmo
         self.seed = seed
+        if(precision not in _PRECISION_DTYPES):
+            raise ValueError('precision must be one of {}, got {}'.format(list(_PRECISION_DTYPES), precision))
+        self.precision = precision
+        if(backend not in ('cpu', 'cupy')):
+            raise ValueError('backend must be one of [\'cpu\', \'cupy\'], got {}'.format(backend))
+        if(backend == 'cupy' and cupy is None):
+            raise ImportError('backend=\'cupy\' requires CuPy')
+        self.backend = backend
 
-        self.profile = NFWProfile(cosmology=self.cosmo, redshift=self.redshift, mdef = '200c')
+        self.profile = _nfw_profile(self.cosmo, self.redshift, mdef = '200c')
         
-        # HaloTools and Colossus expect masses,radii with h dependence, so scale accordingly on input and output
+        # HaloTools and Colossus expect masses,radii with h dependence, so scale accordingly on input and output.
+        # The mass-radius conversion uses the density threshold already tabulated by the (cached) profile, 
+        # rather than NFWProfile.halo_mass_to_halo_radius, which recomputes it from the cosmology on every call
+        rho_thresh = self.profile.density_threshold # h^2 M_sun/Mpc^3
         if(r200c is None):
             self.m200ch = m200c * cosmo.h # M_sun/h
-            self.r200ch = self.profile.halo_mass_to_halo_radius(self.m200ch) #proper Mpc/h
+            self.r200ch = np.cbrt(3*self.m200ch / (4*np.pi*rho_thresh)) #proper Mpc/h
             self.r200c = self.r200ch / cosmo.h # proper Mpc
         if(m200c is None):
             self.r200ch = r200c * cosmo.h # proper Mpc/h
-            self.m200ch = self.profile.halo_radius_to_halo_mass(self.r200ch) # M_sun/h
+            self.m200ch = 4*np.pi/3 * rho_thresh * self.r200ch**3 # M_sun/h
             self.m200c = self.m200ch / cosmo.h # M_sun
             
         # these to be filled by populate_halo()
         self.r = None
-        self.theta = None
+        self.cos_theta = None
+        self.sin_theta = None
         self.phi = None
+        self._theta = None
         self.mpp = None
         self.max_rfrac = None
         self.populated = False
         
+        # cartesian particle positions relative to the halo center, cached by populate_halo() so that
+        # output_particles() need not repeat the coordinate transformation
+        self._x_local = None
+        self._y_local = None
+        self._z_local = None
+        
+        # tabulated comoving distance-redshift relation, used to assign particle redshifts in 
+        # output_particles(). The table extends well past the halo redshift, so that all particle 
+        # distances are bracketed; it is shared by all halos below z=2 in the same cosmology, and above 
+        # that, zmax is rounded up to the next power of two, so that few distinct tables are ever built
+        zmax = 2*self.redshift + 1
+        zmax = 5.0 if zmax <= 5 else 2.0**math.ceil(math.log2(zmax))
+        self._d_grid, self._z_grid = _build_z_of_dcom(self.cosmo, zmax=zmax)
+        
         if c is not None:
             self.c = c
             self.c_err = 0
         else:
-            # if cM_err=True, draw a concentration from gaussian, otherwise use Child+2018 cM relation scatter-free
-            rand = np.random.RandomState(self.seed)
+            # if cM_err=True, draw a concentration from gaussian, otherwise use Child+2018 cM relation scatter-free.
+            # The concentration has its own stream, independent of those of the particle positions
+            rand = np.random.default_rng(self._stream_seed(_CONC_STREAM))
             
-            cosmo_colossus = colcos.setCosmology('OuterRim',
-                             {'Om0':cosmo.Om0, 'Ob0':cosmo.Ob0, 'H0':cosmo.H0.value, 'sigma8':0.8, 
-                              'ns':0.963, 'relspecies':False})
-            c_u = mass_conc(self.m200ch, '200c', z, model='child18')
+            c_u = _child18_concentration(cosmo, self.m200ch, z)
             if(cM_err):
                 c_sig = c_u/3
                 self.c = rand.normal(loc=c_u, scale=c_sig) 
@@ -117,11 +595,234 @@ class NFW:
     # -----------------------------------------------------------------------------------------------
 
 
-    def populate_halo(self, N=10000, rfrac=1, rfrac_los=None):
+    # the following depend only on the cosmology and redshift of the halo, which are fixed after 
+    # construction, and so are computed once on first access
+
+    @functools.cached_property
+    def halo_r(self):
+        """
+        The comoving distance to the halo, in Mpc. Interpolated from the shared distance-redshift table 
+        (see _build_z_of_dcom()), rather than evaluated by AstroPy per halo
+        """
+        return float(np.interp(self.redshift, self._z_grid, self._d_grid))
+
+    @functools.cached_property
+    def _trans_Mpc_per_arcsec(self):
+        """
+        The transverse comoving distance per arcsec at the redshift of the halo, in Mpc. This is 
+        the comoving transverse distance scaled by _RAD2ARCSEC, which in a flat cosmology is just 
+        the (already computed) comoving distance to the halo
+        """
+        if(self.cosmo.Ok0 == 0):
+            return self.halo_r / _RAD2ARCSEC
+        return self.cosmo.comoving_transverse_distance(self.redshift).value / _RAD2ARCSEC
+
+    @property
+    def _xp(self):
+        """
+        The array module, numpy or cupy, used to generate the particle realization
+        """
+        return cupy if self.backend == 'cupy' else np
+
+    @property
+    def theta(self):
+        """
+        The coaltitude of each particle, in radians. Only the cosine and sine of the coaltitude are 
+        needed to populate and output the halo, so the arccos is evaluated on first access
+        """
+        if(self._theta is None and self.cos_theta is not None):
+            self._theta = np.arccos(self.cos_theta)
+        return self._theta
+     
+    
+    # -----------------------------------------------------------------------------------------------
+
+
+    @classmethod
+    def batch(cls, z, m200c=None, r200c=None, c=None, cM_err=False, cosmo=cm.OuterRim_params, seed=None, 
+              precision='fp32', backend='cpu'):
+        """
+        Constructs many NFW objects at once, broadcasting the halo parameters against z. All halos 
+        share one cosmology, and so share distance-redshift tables (see _build_z_of_dcom()). The comoving 
+        distances of all halos sharing a table are interpolated from it with one vectorized call, rather 
+        than one call per halo on first access of halo_r; the values are identical.
+
+        Parameters
+        ----------
+        z : float array
+            The redshifts of the halos
+        m200c : float array, optional
+            The halo masses, as in the NFW constructor
+        r200c : float array, optional
+            The halo radii, as in the NFW constructor
+        c : float array, optional
+            The halo concentrations, as in the NFW constructor
+        cM_err : bool, optional
+            As in the NFW constructor
+        cosmo : object, optional
+            An AstroPy cosmology object, shared by all halos. Defaults to OuterRim parameters.
+        seed : int, optional
+            If given, the i-th halo is seeded with seed+i. Defaults to None
+        precision : string, optional
+            As in the NFW constructor
+        backend : string, optional
+            As in the NFW constructor
+
+        Returns
+        -------
+        halos : list of NFW objects
+        """
+        z = np.atleast_1d(z)
+        nhalos = len(z)
+        m200c = np.broadcast_to(np.array(m200c, dtype=object), nhalos)
+        r200c = np.broadcast_to(np.array(r200c, dtype=object), nhalos)
+        c = np.broadcast_to(np.array(c, dtype=object), nhalos)
+        
+        halos = []
+        for i in range(nhalos):
+            halo = cls(z[i], m200c=m200c[i], r200c=r200c[i], c=c[i], cM_err=cM_err, cosmo=cosmo,
+                       seed=None if seed is None else seed+i, precision=precision, backend=backend)
+            halos.append(halo)
+        
+        # halos at different redshifts may hold different tables (see the NFW constructor); group them 
+        # by table, and preset halo_r for each group
+        groups = {}
+        for i,halo in enumerate(halos):
+            groups.setdefault(id(halo._d_grid), []).append(i)
+        for idx in groups.values():
+            d_grid, z_grid = halos[idx[0]]._d_grid, halos[idx[0]]._z_grid
+            halo_r = np.interp(z[idx], z_grid, d_grid)
+            for i,hr in zip(idx, halo_r):
+                halos[i].halo_r = float(hr)
+        return halos
+     
+    
+    # -----------------------------------------------------------------------------------------------
+
+
+    def _stream_seed(self, *key):
+        """
+        Returns the seed of one of the random streams of this halo, as the child of 
+        np.random.SeedSequence(self.seed) at the given spawn key (e.g. (_RADIAL_STREAM, k) for the k-th 
+        chunk of the radial positions). This is the SeedSequence that spawn() would give, but constructed 
+        directly, so that the same stream is returned on every call. Children of distinct keys, or of 
+        distinct halo seeds, are statistically independent (unlike offsets of one integer seed, which 
+        collide across halos). For the cupy backend, an integer seed drawn from the child is returned 
+        instead. If self.seed is None, returns None, for fresh entropy on every call.
+
+        Parameters
+        ----------
+        key : ints
+            The spawn key of the stream
+        """
+        if(self.seed is None):
+            return None
+        seed = np.random.SeedSequence(self.seed, spawn_key=key)
+        if(self.backend == 'cupy'):
+            return int(seed.generate_state(1)[0])
+        return seed
+     
+    
+    # -----------------------------------------------------------------------------------------------
+
+
+    def _radial_positions(self, N, conc, halo_radius, n_workers=1):
+        """
+        Draws N radial positions, in proper Mpc/h, from the NFW profile of this halo truncated at 
+        halo_radius, by inverse transform sampling of its tabulated cumulative mass profile (see 
+        _nfw_icdf_table()). If n_workers > 1 and N >= _PARALLEL_MIN_N, the draw is split into n_workers 
+        chunks, each generated in its own process from an independent stream, and the results concatenated.
+
+        Parameters
+        ----------
+        N : int
+            The number of positions to draw
+        conc : float
+            The concentration of the truncated profile, halo_radius/r_s
+        halo_radius : float
+            The truncation radius of the profile, in proper Mpc/h
+        n_workers : int, optional
+            The number of processes to use; ignored for the cupy backend. Defaults to 1
+        """
+        if(self.backend == 'cupy'):
+            # the whole draw is done on the device; only the (small) tabulated profile is transferred
+            cdf, x_grid = _nfw_icdf_table(conc)
+            u = cupy.random.default_rng(self._stream_seed(_RADIAL_STREAM)).random(N)
+            r = cupy.interp(u, cupy.asarray(cdf), cupy.asarray(x_grid))
+            r *= halo_radius / conc
+            return r
+        if(n_workers <= 1 or N < _PARALLEL_MIN_N):
+            return _radial_positions_chunk((N, conc, halo_radius, self._stream_seed(_RADIAL_STREAM)))
+        
+        chunks = [N // n_workers] * n_workers
+        chunks[-1] += N % n_workers
+        seeds = [self._stream_seed(_RADIAL_STREAM, k) for k in range(n_workers)]
+        args = [(n, conc, halo_radius, seed) for n,seed in zip(chunks, seeds)]
+        with ProcessPoolExecutor(max_workers=n_workers) as ex:
+            return np.concatenate(list(ex.map(_radial_positions_chunk, args)))
+     
+    
+    # -----------------------------------------------------------------------------------------------
+
+
+    def _angular_positions(self, N):
+        """
+        Draws N angular positions uniformly distributed on the sphere. Note that this is not the same 
+        as a uniform distribution in theta and phi over [0, pi] and [0, 2pi], since the area element 
+        on a sphere is a function of the coaltitude! See http://mathworld.wolfram.com/SpherePointPicking.html 
+        For a uniform deviate u, cos(theta) = 2u-1, and so sin(theta) = 2*sqrt(u(1-u)); both are 
+        computed directly from u (in place), and theta itself is never needed.
+
+        Parameters
+        ----------
+        N : int
+            The number of positions to draw
+
+        Returns
+        -------
+        cos_theta, sin_theta, phi : float32 arrays
+            The cosine and sine of the coaltitude, and the azimuthal coordinate in radians
+        """
+        # both uniform deviates are drawn in one call
+        xp = self._xp
+        rand = xp.random.default_rng(self._stream_seed(_ANGULAR_STREAM))
+        u, phi = rand.random((2, N), dtype=xp.float32)
+        xp.multiply(phi, 2*np.pi, out=phi)
+        
+        sin_theta = xp.subtract(1, u)
+        xp.multiply(sin_theta, u, out=sin_theta)
+        xp.sqrt(sin_theta, out=sin_theta)
+        xp.multiply(sin_theta, 2, out=sin_theta)
+        cos_theta = u
+        xp.multiply(cos_theta, 2, out=cos_theta)
+        xp.subtract(cos_theta, 1, out=cos_theta)
+        return cos_theta, sin_theta, phi
+     
+    
+    # -----------------------------------------------------------------------------------------------
+
+
+    def _to_host(self):
+        """
+        Copies the particle realization from the device to the host, if it was generated by the cupy 
+        backend, so that output_particles() can proceed with numpy
+        """
+        if(self.backend != 'cupy'):
+            return
+        for name in ('r', 'cos_theta', 'sin_theta', 'phi', '_x_local', '_y_local', '_z_local'):
+            val = getattr(self, name)
+            if(val is not None):
+                setattr(self, name, cupy.asnumpy(val))
+     
+    
+    # -----------------------------------------------------------------------------------------------
+
+
+    def populate_halo(self, N=10000, rfrac=1, rfrac_los=None, n_workers=1):
         """
         Generates a 3-dimensional relization of the discreteley-sampled NFW mass distribution for
-        this halo. The radial positions are obtained with the HaloTools 
-        mc_generate_nfw_radial_positions module. The angular positions are drawn from a uniform 
+        this halo. The radial positions are obtained by inverse transform sampling of the tabulated 
+        NFW cumulative mass profile. The angular positions are drawn from a uniform 
         random distribution, the azimuthal coordiante ranging from 0 to 2pi, and the coaltitude 
         from 0 to pi.
 
@@ -140,51 +841,50 @@ class NFW:
             the argument is kept for rather specific debugging purposes, but probably should not be used. 
             Default is None, in which case no clipping is performed. Also if rfrac_los > rfrac, obviously 
             nothing will happen.
+        n_workers : int, optional
+            The number of processes across which to split the generation of the radial positions. 
+            Only used if N >= _PARALLEL_MIN_N; see _radial_positions(). Defaults to 1
         """
        
         self.populated = True
         
-        # the radial positions in proper Mpc
-        r = self.profile.mc_generate_nfw_radial_positions(num_pts = N, conc = rfrac * self.c, 
-                                                          halo_radius = rfrac * self.r200ch, seed=self.seed+1)
-        self.r = r / self.cosmo.h
+        # the radial positions in proper Mpc/h (stored as float32, as are the angular positions below, 
+        # matching the precision of the binary outputs)
+        r = self._radial_positions(N, rfrac * self.c, rfrac * self.r200ch, n_workers)
+        self.r = r.astype('f')
         self.max_rfrac = rfrac
 
         # compute mass enclosed to find mass per particle
-        # (this is the analytic integration of the NFW profile in terms of m_200c, assuming c=c_200c)
-        rs = self.r200c / self.c
-        rmax = rfrac * self.r200c
-        n = np.log((rs+rmax)/rs) - rmax/(rmax+rs)
-        d = np.log(1+self.c) - self.c/(1+self.c)
-        M_enc = self.m200c * n/d
+        M_enc = _nfw_m_enc(self.m200c, self.c, rfrac)
         self.mpp = M_enc / N
 
         # radial positions need to be in comoving comoving coordiantes, as the kappa maps in the raytracing
-        # modules expect the density estimation to be done on a comoving set of particles        
-        self.r = self.r * (1+self.redshift)
+        # modules expect the density estimation to be done on a comoving set of particles (the removal 
+        # of h and the comoving scaling are applied together, in place)
+        self.r *= (1+self.redshift) / self.cosmo.h
         
         # now let's add in uniform random positions in the angular coordinates as well
-        # Note that this is not the same as a uniform distribution in theta and phi 
-        # over [0, pi] and [0, 2pi], since the area element on a sphere is a function of 
-        # the coaltitude! See http://mathworld.wolfram.com/SpherePointPicking.html 
-        rand = np.random.RandomState(self.seed) 
-        v = rand.uniform(low=0, high=1, size = len(r))
-        self.phi = rand.uniform(low=0, high=2*np.pi, size = len(r))
-        self.theta = np.arccos(2*v-1)
+        self.cos_theta, self.sin_theta, self.phi = self._angular_positions(len(r))
+        self._theta = None
         
         # finally, do los clipping if user requested (in self.output_particles below, the los dimension 
         # is assumed to be the cartesian x)
-        x = self.r *  np.sin(self.theta) * np.cos(self.phi)
+        x, y, z = _sph_to_cart(self.r, self.cos_theta, self.sin_theta, self.phi)
+        # (the mask is converted to indices once, and the same gather applied to all six arrays)
         if(rfrac_los is not None):
-            los_mask = (np.abs(x)/self.r200c) <= rfrac_los
-            self.r, self.theta, self.phi = self.r[los_mask], self.theta[los_mask], self.phi[los_mask]
+            keep = self._xp.flatnonzero((self._xp.abs(x)/self.r200c) <= rfrac_los)
+            self.r, self.phi = self.r[keep], self.phi[keep]
+            self.cos_theta, self.sin_theta = self.cos_theta[keep], self.sin_theta[keep]
+            x, y, z = x[keep], y[keep], z[keep]
+        self._x_local, self._y_local, self._z_local = x, y, z
+        self._to_host()
     
     
     # -----------------------------------------------------------------------------------------------
     
 
 
-    def populate_halo_fov(self, N=10000, rfrac=1, depth=None):
+    def populate_halo_fov(self, N=10000, rfrac=1, depth=None, n_workers=1):
         """
         eventually merge with function above...
         """
@@ -197,43 +897,36 @@ class NFW:
         halo_radius = np.sqrt(2) * radius * self.r200ch
         conc = np.sqrt(2) * radius * self.c
         
-        # the radial positions in proper Mpc
-        r = self.profile.mc_generate_nfw_radial_positions(num_pts = N, conc = conc, 
-                                                          halo_radius = halo_radius, seed=self.seed+1)
-        self.r = r / self.cosmo.h
+        # the radial positions in proper Mpc/h (stored as float32, as are the angular positions below, 
+        # matching the precision of the binary outputs)
+        r = self._radial_positions(N, conc, halo_radius, n_workers)
+        self.r = r.astype('f')
         self.max_rfrac = rfrac
 
         # compute mass enclosed to find mass per particle
-        # (this is the analytic integration of the NFW profile in terms of m_200c, assuming c=c_200c)
-        rs = self.r200c / self.c
-        rmax = rfrac * self.r200c
-        n = np.log((rs+rmax)/rs) - rmax/(rmax+rs)
-        d = np.log(1+self.c) - self.c/(1+self.c)
-        M_enc = self.m200c * n/d
+        M_enc = _nfw_m_enc(self.m200c, self.c, rfrac)
         self.mpp = M_enc / N
 
         # radial positions need to be in comoving comoving coordiantes, as the kappa maps in the raytracing
-        # modules expect the density estimation to be done on a comoving set of particles        
-        self.r = self.r * (1+self.redshift)
+        # modules expect the density estimation to be done on a comoving set of particles (the removal 
+        # of h and the comoving scaling are applied together, in place)
+        self.r *= (1+self.redshift) / self.cosmo.h
         
         # now let's add in uniform random positions in the angular coordinates as well
-        # Note that this is not the same as a uniform distribution in theta and phi 
-        # over [0, pi] and [0, 2pi], since the area element on a sphere is a function of 
-        # the coaltitude! See http://mathworld.wolfram.com/SpherePointPicking.html 
-        rand = np.random.RandomState(self.seed) 
-        v = rand.uniform(low=0, high=1, size = len(r))
-        self.phi = rand.uniform(low=0, high=2*np.pi, size = len(r))
-        self.theta = np.arccos(2*v-1)
+        self.cos_theta, self.sin_theta, self.phi = self._angular_positions(len(r))
+        self._theta = None
         
         # trim the particle population to the fov
         # move to polar coordinates, with x the los dimension
-        x = self.r *  np.sin(self.theta) * np.cos(self.phi)
-        y = self.r *  np.sin(self.theta) * np.sin(self.phi)
-        z = self.r *  np.cos(self.theta)
-        fov_mask = np.logical_and.reduce((np.abs(x) <= depth * self.r200c, 
-                                          np.abs(y) <= rmax * self.r200c,
-                                          np.abs(z) <= rmax * self.r200c))
-        self.r, self.theta, self.phi = self.r[fov_mask], self.theta[fov_mask], self.phi[fov_mask] 
+        x, y, z = _sph_to_cart(self.r, self.cos_theta, self.sin_theta, self.phi)
+        xp = self._xp
+        keep = xp.flatnonzero((xp.abs(x) <= depth * self.r200c) & 
+                              (xp.abs(y) <= rfrac * self.r200c) &
+                              (xp.abs(z) <= rfrac * self.r200c))
+        self.r, self.phi = self.r[keep], self.phi[keep]
+        self.cos_theta, self.sin_theta = self.cos_theta[keep], self.sin_theta[keep]
+        self._x_local, self._y_local, self._z_local = x[keep], y[keep], z[keep]
+        self._to_host()
     
     
     # -----------------------------------------------------------------------------------------------
@@ -266,34 +959,45 @@ class NFW:
         if(self.populated == False):
             raise RuntimeError('populate_halo must be called before output_particles')
         if(vis_output_dir is None): vis_output_dir = output_dir
-        if not os.path.exists(output_dir):
-                os.makedirs(output_dir, exist_ok=True)
-
-        # now find projected positions wrt origin after pushing halo down x-axis (Mpc and arcsec)
-        self.halo_r = self.cosmo.comoving_distance(self.redshift).value
-        x = self.r *  np.sin(self.theta) * np.cos(self.phi) + self.halo_r
-        y = self.r *  np.sin(self.theta) * np.sin(self.phi)
-        z = self.r *  np.cos(self.theta)
-        r_fov = np.linalg.norm([y, z], axis=0)
-        r_sky = np.linalg.norm([x,y,z], axis=0)
-        theta_sky = np.arccos(z/r_sky) * 180/np.pi * 3600
-        phi_sky = np.arctan(y/x) * 180/np.pi * 3600
+        pathlib.Path(output_dir).mkdir(parents=True, exist_ok=True)
+
+        # all output quantities are written directly into the rows of one contiguous little-endian 
+        # float32 buffer, in the order of the output file names
+        out = np.empty((len(_PARTICLE_BIN_NAMES), len(self.r)), dtype='<f4')
+        
+        # now find projected positions wrt origin after pushing halo down x-axis (Mpc and arcsec); 
+        # the cartesian positions relative to the halo center were already computed by populate_halo().
+        # For a halo much smaller than its distance (the usual case), the angles are linear in the offsets
+        small_angle = np.max(self.r) < _SMALL_ANGLE_MAX * self.halo_r
+        x, y, z, r_sky, theta_sky, phi_sky = _local_to_sky(self._x_local, self._y_local, self._z_local, self.halo_r, 
+                                                           out=(out[0], out[1], out[2], 
+                                                                np.empty(len(self.r), dtype='f'), out[3], out[4]),
+                                                           small_angle=small_angle)
        
-        # get particle redshifts
-        zmin = z_at_value(self.cosmo.comoving_distance, ((r_sky.min()-0.1)*u.Mpc))
-        zmax = z_at_value(self.cosmo.comoving_distance, ((r_sky.max()+0.1)*u.Mpc))
-        z_samp = np.linspace(zmin, zmax, 10)
-        x_samp = self.cosmo.comoving_distance(z_samp).value
-        invfunc = scipy.interpolate.interp1d(x_samp, z_samp)
-        redshift = invfunc(r_sky)
+        # get particle redshifts by inverting the tabulated comoving distance-redshift relation; 
+        # np.interp has no out argument, so this is done in chunks to bound its float64 temporaries
+        redshift = out[5]
+        for i in range(0, len(redshift), 1<<20):
+            np.copyto(redshift[i:i+(1<<20)], np.interp(r_sky[i:i+(1<<20)], self._d_grid, self._z_grid), 
+                      casting='same_kind')
 
         if(vis_debug):
+            # plotting imports are deferred to here, so that they are not paid for on import of this module
+            import matplotlib.pyplot as plt
+            from matplotlib import rc
+            from mpl_toolkits.mplot3d import Axes3D
+            rc('text', usetex=True)
+            
             print(vis_output_dir)
             f = plt.figure(figsize=(12,6))
             ax = f.add_subplot(121, projection='3d')
             ax2 = f.add_subplot(122)
 
-            ax.scatter(x, y, z, c='k', alpha=0.25)
+            # the 3d view is drawn for a strided subsample of ~5000 particles (the particles are drawn 
+            # independently, so any stride is an unbiased subsample) as rasterized markers, rather than 
+            # per-point scatter artists; the axis limits use the full population
+            stride = max(1, len(x)//5000)
+            ax.plot(x[::stride], y[::stride], z[::stride], 'k.', markersize=1, alpha=0.25, rasterized=True)
             max_range = np.array([x.max()-x.min(), y.max()-y.min(), z.max()-z.min()]).max() / 2.0
             mid_x = (x.max()+x.min()) * 0.5
             mid_y = (y.max()+y.min()) * 0.5
@@ -306,18 +1010,14 @@ class NFW:
             ax.set_ylabel(r'$y\>[Mpc/h]$', fontsize=16)
             ax.set_zlabel(r'$z\>[Mpc/h]$', fontsize=16)
 
-            ax2.scatter(theta_sky, phi_sky, c='k', alpha=0.2)
+            # the projected distribution is binned rather than scattered, which is O(N) with no per-point artists
+            ax2.hexbin(theta_sky, phi_sky, gridsize=200, cmap='Greys', bins='log')
             ax2.set_xlabel(r'$\theta\>[\mathrm{arsec}]$', fontsize=16)
             ax2.set_ylabel(r'$\phi\>[\mathrm{arcsec}]$', fontsize=16)
             plt.savefig('{}/nfw_particles.png'.format(vis_output_dir), dpi=300)
 
         # write out all to binary
-        x.astype('f').tofile('{}/x.bin'.format(output_dir))
-        y.astype('f').tofile('{}/y.bin'.format(output_dir))
-        z.astype('f').tofile('{}/z.bin'.format(output_dir))
-        theta_sky.astype('f').tofile('{}/theta.bin'.format(output_dir))
-        phi_sky.astype('f').tofile('{}/phi.bin'.format(output_dir))
-        redshift.astype('f').tofile('{}/redshift.bin'.format(output_dir))
+        _write_particle_bins(output_dir, out, dtypes=_PRECISION_DTYPES[self.precision])
     
         if(fov_multiplier is not None):
             fov_size = fov_multiplier * np.max(self.r)
@@ -329,7 +1029,7 @@ class NFW:
             # then has a side length of 2*(rfrac*r200c)/sqrt(2) --> radius = (rfrac*r200c)/sqrt(2). 
             # Replace rfrac*r200c by the radial distance to the furthest particle and trim by 5%, to be safe.
             # Also note that self.r is a comoving distance, which is correct
-            fov_size = 0.95 * (np.max(r_fov) / np.sqrt(2))
+            fov_size = 0.95 * (np.max(np.hypot(y, z)) / np.sqrt(2))
         self._write_prop_file(fov_size, output_dir)
     
     
@@ -355,19 +1055,89 @@ class NFW:
 
         # find the angular scale corresponding to fov_r200c * r200c in proper Mpc at the redshift of the halo
         boxRadius_Mpc = fov_radius
-        trans_Mpc_per_arcsec = (self.cosmo.kpc_proper_per_arcmin(self.redshift).value/1e3)/60 * (self.redshift+1)
-        boxRadius_arcsec = boxRadius_Mpc / trans_Mpc_per_arcsec
+        boxRadius_arcsec = boxRadius_Mpc / self._trans_Mpc_per_arcsec
+
+        props = {'halo_redshift':self.redshift, 'sod_halo_mass':self.m200c, 'sod_halo_radius':self.r200c, 
+                 'sod_halo_cdelta':self.c, 'sod_halo_cdelta_error':self.c_err, 
+                 'halo_lc_x':0, 'halo_lc_y':0, 'halo_lc_z':0, 
+                 'boxRadius_Mpc':boxRadius_Mpc, 'boxRadius_arcsec':boxRadius_arcsec, 'mpp':self.mpp}
+        _write_props(output_dir, props)
+
+
+
+
+# ======================================================================================================
+
+
+# the cosmology shared by all halos built in a worker process, set once per worker by _init_worker()
+_worker_cosmo = None
+def _init_worker(cosmo):
+    """
+    Initializes a build_halos() worker process. The cosmology is unpickled once per worker, rather than
+    once per halo, so that the caches keyed on it (profiles, distance tables) are shared by every halo 
+    the worker builds; the default distance-redshift table is built up front.
+
+    Parameters
+    ----------
+    cosmo : object
+        An AstroPy cosmology object
+    """
+    global _worker_cosmo
+    _worker_cosmo = cosmo
+    _build_z_of_dcom(cosmo)
 
-        cols = '#halo_redshift, sod_halo_mass, sod_halo_radius, sod_halo_cdelta, sod_halo_cdelta_error, '\
-               'halo_lc_x, halo_lc_y, halo_lc_z, boxRadius_Mpc, boxRadius_arcsec, mpp'
-        props = np.array([self.redshift, self.m200c, self.r200c, self.c, self.c_err, 
-                          0, 0, 0, boxRadius_Mpc, boxRadius_arcsec, self.mpp])
-        
-        np.savetxt('{}/properties.csv'.format(output_dir), [props],
-                   fmt='%.6f,%.6f,%.6f,%.6f,%.6f,%.6f,%.6f,%.6f,%.6f,%.6f,%.6f', 
-                   delimiter=',',header=cols)
 
+def _build_one(params):
+    """
+    Constructs, populates, and outputs a single NFW halo realization. Defined at module level so that 
+    it can be dispatched to worker processes by build_halos()
 
+    Parameters
+    ----------
+    params : dict
+        Dictionary with the keys 'init', 'populate', and 'output', each giving a dict of keyword 
+        arguments to pass to NFW(), NFW.populate_halo(), and NFW.output_particles(), respectively. 
+        The 'populate' and 'output' entries are optional. If 'init' gives no cosmo, the worker's 
+        shared cosmology is used.
+    """
+    init = params['init']
+    if('cosmo' not in init and _worker_cosmo is not None):
+        init = dict(init, cosmo=_worker_cosmo)
+    halo = NFW(**init)
+    halo.populate_halo(**params.get('populate', {}))
+    halo.output_particles(**params.get('output', {}))
+    return params.get('output', {}).get('output_dir')
+
+
+def build_halos(halo_params, n_workers=None, seed=None, cosmo=cm.OuterRim_params):
+    """
+    Generates and outputs particle realizations for many NFW halos in parallel. Each halo is independent,
+    and so is built entirely by one worker process. Each worker receives the cosmology once, on startup.
+
+    Parameters
+    ----------
+    halo_params : list of dicts
+        One entry per halo, in the form expected by _build_one(). Each should specify a distinct 
+        output_dir in its 'output' keyword arguments.
+    n_workers : int, optional
+        The number of worker processes. Defaults to None, in which case the number of processors
+        on the machine is used
+    seed : int, optional
+        If given, the i-th halo is seeded with seed+i (overriding any seed passed in its 'init' keyword
+        arguments), so that the ensemble is reproducible. Defaults to None
+    cosmo : object, optional
+        An AstroPy cosmology object, used for all halos that don't give their own in their 'init' 
+        keyword arguments. Defaults to OuterRim parameters.
+
+    Returns
+    -------
+    output_dirs : list of strings
+        The output directory of each halo, in the order of halo_params
+    """
+    if(seed is not None):
+        halo_params = [dict(p, init=dict(p['init'], seed=seed+i)) for i,p in enumerate(halo_params)]
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker, initargs=(cosmo,)) as ex:
+        return list(ex.map(_build_one, halo_params))
 
 
 # ======================================================================================================
@@ -377,3 +1147,8 @@ class NFW:
 #hh = simple_halo(m200c = 1e14, z = 0.3)
 #hh.populate_halo(N = 10000, rfrac = 6)
 #hh.output_particles(vis_debug=True)
+
+# example usage of parallel generation
+#params = [{'init':{'m200c':m, 'z':0.3}, 'populate':{'N':10000, 'rfrac':6},
+#           'output':{'output_dir':'./nfw_{:.0e}'.format(m)}} for m in [1e13, 1e14, 1e15]]
+#build_halos(params, seed=100)